@@ -56,3 +56,24 @@ DNS_SUFFIXES = [
 # Set to True to create records like: server1 → 100.64.0.1
 # Set to False to only create records with suffixes
 CREATE_BARE_HOSTNAME = False
+
+
+# ============================================================================
+# Scheduling Configuration
+# ============================================================================
+
+# Maximum random delay (in seconds) before an --apply --quiet (scheduled) run starts.
+# This spreads out runs started by cron at the same wall-clock time so they
+# don't all hit the Tailscale and ControlD APIs at once. Set to 0 to disable.
+# Rate-limited (HTTP 429) responses are retried, honoring their Retry-After.
+JITTER_SECONDS = 30
+
+
+# ============================================================================
+# Backup Configuration
+# ============================================================================
+
+# Number of gzipped rule backups to keep in the working directory.
+# Older controld_backup_*.json.gz files are deleted after each new backup.
+# Set to 0 to keep all backups.
+BACKUP_RETENTION = 10
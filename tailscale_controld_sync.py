@@ -4,14 +4,25 @@ Sync Tailscale nodes to ControlD DNS records.
 This script fetches all Tailscale nodes and creates/updates DNS records in ControlD.
 """
 
-import requests
+import asyncio
+import functools
+import gzip
+import httpx
+import ijson
+import itertools
+import orjson
+import os
+import random
 import sys
-import json
+import threading
+import time
 import argparse
 import importlib.util
 from pathlib import Path
-from datetime import datetime
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
  
 # Import configuration
 try:
@@ -38,17 +49,256 @@ try:
     CONTROLD_FOLDER_NAME = config_module.CONTROLD_FOLDER_NAME
     DNS_SUFFIXES = config_module.DNS_SUFFIXES
     CREATE_BARE_HOSTNAME = config_module.CREATE_BARE_HOSTNAME
+    JITTER_SECONDS = getattr(config_module, 'JITTER_SECONDS', 30)
+    BACKUP_RETENTION = getattr(config_module, 'BACKUP_RETENTION', 10)
 except (FileNotFoundError, ImportError, AttributeError) as e:
     print(f"Error loading config.py: {e}")
     print("\nPlease create a config.py file with your configuration.")
     print("You can copy config_example.py and rename it to config.py")
     sys.exit(1)
 
+# DNS suffixes with surrounding whitespace and empty entries removed
+CLEAN_SUFFIXES = tuple(s for s in (x.strip() for x in DNS_SUFFIXES) if s)
+
 # API endpoints
 TAILSCALE_API_BASE = 'https://api.tailscale.com/api/v2'
 CONTROLD_API_BASE = 'https://api.controld.com'
 
 
+# Retry policy for transient API failures. Rate-limited (429) requests were
+# not processed, so they are retried for any method; other statuses only for
+# idempotent methods.
+RETRY_TOTAL = 3
+RETRY_BACKOFF_FACTOR = 0.5
+# Longest Retry-After delay honored before retrying anyway
+RETRY_AFTER_MAX = 60
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+RETRY_METHODS = frozenset({'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'})
+
+HTTP_TIMEOUT = httpx.Timeout(10.0)
+HTTP_LIMITS = httpx.Limits(max_connections=16, max_keepalive_connections=16)
+
+
+def _should_retry(request: httpx.Request, response: httpx.Response, attempt: int) -> bool:
+    """Return True if a response is a transient failure worth retrying."""
+    if attempt >= RETRY_TOTAL:
+        return False
+    if response.status_code == 429:
+        return True
+    return request.method in RETRY_METHODS and response.status_code in RETRY_STATUSES
+
+
+def _retry_delay(response: httpx.Response, attempt: int) -> float:
+    """Delay before the given retry attempt.
+
+    Honors a Retry-After header (seconds or HTTP date), otherwise uses
+    exponential backoff.
+    """
+    retry_after = response.headers.get('Retry-After')
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0.0), RETRY_AFTER_MAX)
+    return RETRY_BACKOFF_FACTOR * (2 ** attempt)
+
+
+class RetryTransport(httpx.HTTPTransport):
+    """HTTP/2 transport that retries transient failures with backoff."""
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            response = super().handle_request(request)
+            if not _should_retry(request, response, attempt):
+                return response
+            response.close()
+            time.sleep(_retry_delay(response, attempt))
+            attempt += 1
+
+
+class AsyncRetryTransport(httpx.AsyncHTTPTransport):
+    """Async HTTP/2 transport that retries transient failures with backoff."""
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            response = await super().handle_async_request(request)
+            if not _should_retry(request, response, attempt):
+                return response
+            await response.aclose()
+            await asyncio.sleep(_retry_delay(response, attempt))
+            attempt += 1
+
+
+def create_client(base_url: str, token: str) -> httpx.Client:
+    """Create a pooled HTTP/2 client authenticated with the given token."""
+    return httpx.Client(
+        base_url=base_url,
+        headers={'Authorization': f'Bearer {token}'},
+        timeout=HTTP_TIMEOUT,
+        transport=RetryTransport(http2=True, limits=HTTP_LIMITS, retries=RETRY_TOTAL)
+    )
+
+
+def create_async_client(base_url: str, token: str) -> httpx.AsyncClient:
+    """Create a pooled async HTTP/2 client authenticated with the given token."""
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers={'Authorization': f'Bearer {token}'},
+        timeout=HTTP_TIMEOUT,
+        transport=AsyncRetryTransport(http2=True, limits=HTTP_LIMITS, retries=RETRY_TOTAL)
+    )
+
+
+# Shared clients for the read-only lookups, so they reuse one connection per
+# host. ControlD changes are sent over a separate async client opened per run.
+TS_CLIENT = create_client(TAILSCALE_API_BASE, TAILSCALE_API_KEY)
+CD_CLIENT = create_client(CONTROLD_API_BASE, CONTROLD_API_TOKEN)
+
+# Cached API responses from the last successful live sync, revalidated with ETags
+SYNC_STATE_FILE = '.sync_state.json'
+
+# Local copies of the Tailscale node and service lists: reused without a
+# request while fresh, revalidated with their ETag after that, and served
+# (with a warning) when the API is unavailable while not too stale
+TS_NODES_CACHE_FILE = '.ts_nodes.cache.json'
+TS_SERVICES_CACHE_FILE = '.ts_services.cache.json'
+TS_CACHE_TTL = 60
+TS_CACHE_MAX_STALE = 3600
+
+# Upper bound on in-flight ControlD mutations, to stay within API rate limits
+CONTROLD_MAX_CONCURRENCY = 16
+
+# Maximum hostnames sent in a single ControlD rule-creation request
+CONTROLD_BATCH_SIZE = 50
+
+# Batch failures that say nothing about the batch's contents, so splitting it
+# into per-hostname requests would only repeat the failure
+BATCH_NO_SPLIT_STATUSES = frozenset({401, 403, 429})
+
+
+_print_lock = threading.Lock()
+
+
+def _log(message: str):
+    """Print a line without interleaving with output from other worker threads."""
+    with _print_lock:
+        print(message)
+
+
+def _json(response: httpx.Response):
+    """Parse a response body as JSON using orjson.
+
+    Raises ValueError (orjson.JSONDecodeError) if the body is not valid JSON.
+    """
+    return orjson.loads(response.content)
+
+
+def _stream_items(response: httpx.Response, prefix: str):
+    """Incrementally parse a streamed JSON response, yielding items under prefix."""
+    items = ijson.sendable_list()
+    parser = ijson.items_coro(items, prefix)
+    for chunk in response.iter_bytes():
+        parser.send(chunk)
+        yield from items
+        del items[:]
+    parser.close()
+    yield from items
+
+
+def _read_json_file(path: str):
+    """Read a JSON file, returning None if it is missing or unreadable."""
+    try:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json_file(path: str, data):
+    """Atomically write data to a JSON file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps(data))
+    os.replace(tmp_path, path)
+
+
+def _remember_response(state: Dict, etag_key: str, etag: Optional[str], **data):
+    """Keep a response in state for ETag revalidation.
+
+    Without an ETag the copy could never be revalidated, so any previous
+    copy is dropped instead of storing it.
+    """
+    if etag:
+        state[etag_key] = etag
+        state.update(data)
+    else:
+        state.pop(etag_key, None)
+        for key in data:
+            state.pop(key, None)
+
+
+def _is_transient_error(error: httpx.HTTPError) -> bool:
+    """Return True if an error says the API is unavailable rather than refusing us.
+
+    Request errors (connection failures, unreadable responses) and 429/5xx
+    responses qualify; other 4xx responses mean a bad key or configuration.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, httpx.RequestError)
+
+
+def ttl_disk_cache(ttl: float, max_stale: float, path: str, label: str):
+    """Cache an API response on disk, revalidating it with its ETag.
+
+    The wrapped function is called with etag set to the cached ETag (or
+    None) and returns (data, etag), or None if the server reports the
+    cached data unchanged. Results younger than ttl seconds are returned
+    without calling the function, unless the wrapper is called with
+    refresh=True, which also skips revalidation. If the call fails with a
+    transient error, a cached result younger than max_stale seconds is
+    returned instead of propagating the error.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, refresh: bool = False, **kwargs):
+            cached = _read_json_file(path)
+            age = time.time() - cached['timestamp'] if cached else None
+            if not refresh and age is not None and age < ttl:
+                _log(f"✓ Found {len(cached['data'])} {label} (cached)")
+                return cached['data']
+            
+            try:
+                result = func(*args, etag=None if refresh or not cached else cached.get('etag'), **kwargs)
+            except httpx.HTTPError as e:
+                if age is None or age >= max_stale or not _is_transient_error(e):
+                    raise
+                _log(f"Warning: {e}\nUsing cached {label} from {age:.0f}s ago")
+                return cached['data']
+            
+            if result is None:
+                data, etag = cached['data'], cached.get('etag')
+                _log(f"✓ Found {len(data)} {label} (unchanged)")
+            else:
+                data, etag = result
+                _log(f"✓ Found {len(data)} {label}")
+            try:
+                _write_json_file(path, {'timestamp': time.time(), 'etag': etag, 'data': data})
+            except OSError as e:
+                _log(f"Warning: Could not write cache {path}: {e}")
+            return data
+        return wrapper
+    return decorator
+
+
 def validate_config():
     """Validate that all required configuration is set."""
     required_vars = {
@@ -70,158 +320,196 @@ def validate_config():
         sys.exit(1)
 
 
-def get_tailscale_nodes() -> List[Dict]:
-    """Fetch all Tailscale nodes."""
-    url = f"{TAILSCALE_API_BASE}/tailnet/{TAILSCALE_TAILNET_ID}/devices"
-    headers = {'Authorization': f'Bearer {TAILSCALE_API_KEY}'}
+@ttl_disk_cache(ttl=TS_CACHE_TTL, max_stale=TS_CACHE_MAX_STALE, path=TS_NODES_CACHE_FILE, label='Tailscale nodes')
+def get_tailscale_nodes(etag: Optional[str] = None) -> Optional[Tuple[List[Dict], Optional[str]]]:
+    """Fetch all Tailscale nodes, or None if they are unchanged since etag.
+
+    The device list is stream-parsed and only the name and addresses of each
+    device are kept. Returns the nodes and their ETag.
+    Raises httpx.HTTPError if the nodes cannot be fetched or parsed.
+    """
+    url = f"/tailnet/{TAILSCALE_TAILNET_ID}/devices"
+    headers = {'If-None-Match': etag} if etag else {}
     
-    try:
-        response = requests.get(url, headers=headers)
+    with TS_CLIENT.stream('GET', url, headers=headers) as response:
+        if response.status_code == 304:
+            return None
         response.raise_for_status()
-        devices = response.json().get('devices', [])
-        print(f"✓ Found {len(devices)} Tailscale nodes")
-        return devices
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching Tailscale nodes: {e}")
-        sys.exit(1)
-
-
-def get_tailscale_services() -> List[Dict]:
-    """Fetch all Tailscale services."""
-    url = f"{TAILSCALE_API_BASE}/tailnet/{TAILSCALE_TAILNET_ID}/services"
-    headers = {'Authorization': f'Bearer {TAILSCALE_API_KEY}'}
-
+        try:
+            devices = [
+                {'name': device.get('name', ''), 'addresses': device.get('addresses', [])}
+                for device in _stream_items(response, 'devices.item')
+            ]
+        except ijson.JSONError as e:
+            raise httpx.DecodingError(f"Invalid JSON in devices response: {e}", request=response.request) from e
+    return devices, response.headers.get('ETag')
+
+
+@ttl_disk_cache(ttl=TS_CACHE_TTL, max_stale=TS_CACHE_MAX_STALE, path=TS_SERVICES_CACHE_FILE, label='Tailscale services')
+def get_tailscale_services(etag: Optional[str] = None) -> Optional[Tuple[List[Dict], Optional[str]]]:
+    """Fetch all Tailscale services, or None if they are unchanged since etag.
+
+    Returns the services and their ETag.
+    Raises httpx.HTTPError if the services cannot be fetched or parsed.
+    """
+    url = f"/tailnet/{TAILSCALE_TAILNET_ID}/services"
+    headers = {'If-None-Match': etag} if etag else {}
+    
+    response = TS_CLIENT.get(url, headers=headers)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        services = response.json().get('vipServices', [])
-        print(f"✓ Found {len(services)} Tailscale services ")
-        for svc in services:
-            orig_name = svc.get('name', '')
-            # Use the canonical name after the ':' if present, otherwise keep original
-            svc['name'] = orig_name.partition(':')[2] or orig_name
-            addrs = svc.get('addrs', [])
-            addr = addrs[0] if addrs else ''
-            # print(f"  Service: {svc.get('name')} -> {addr}")
-        return services
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching Tailscale services: {e}")
-        sys.exit(1)
-
-
-def get_tailscale_records() -> Dict[str, str]:
-    """Fetch Tailscale nodes & services and build the desired DNS records map.
-
-    Returns a dict mapping hostname -> ip.
+        services = _json(response).get('vipServices', [])
+    except ValueError as e:
+        raise httpx.DecodingError(f"Invalid JSON in services response: {e}", request=response.request) from e
+    for svc in services:
+        orig_name = svc.get('name', '')
+        # Use the canonical name after the ':' if present, otherwise keep original
+        svc['name'] = orig_name.partition(':')[2] or orig_name
+        addrs = svc.get('addrs', [])
+        addr = addrs[0] if addrs else ''
+        # print(f"  Service: {svc.get('name')} -> {addr}")
+    services = [{'name': svc.get('name', ''), 'addrs': svc.get('addrs', [])} for svc in services]
+    return services, response.headers.get('ETag')
+
+
+def _compile_record_builder() -> Callable[[str, str, Dict[str, str]], None]:
+    """Generate a function that adds every configured DNS name for a host.
+
+    The function is specialized for CLEAN_SUFFIXES and CREATE_BARE_HOSTNAME,
+    so adding a host's records is a few straight-line dict stores.
     """
-    desired_records: Dict[str, str] = {}
-
-    # Fetch nodes and services
-    tailscale_nodes = get_tailscale_nodes()
-    tailscale_services = get_tailscale_services()
-
-    # Add nodes
-    for node in tailscale_nodes:
-        raw_name = node.get('name', '')
-        device_name = raw_name.split('.', 1)[0].lower() if raw_name else ''
-        ip = node.get('addresses', [''])[0]  # Get first IP (usually IPv4)
-
-        if not device_name or not ip:
-            continue
+    lines = []
+    if CREATE_BARE_HOSTNAME:
+        lines.append("    out[name] = ip")
+    for suffix in CLEAN_SUFFIXES:
+        lines.append(f"    out[name + {'.' + suffix!r}] = ip")
+    source = "def build_records(name, ip, out):\n" + "\n".join(lines or ["    pass"])
+    
+    namespace: Dict = {}
+    exec(source, namespace)
+    return namespace['build_records']
 
-        if CREATE_BARE_HOSTNAME:
-            desired_records[device_name] = ip
 
-        for suffix in DNS_SUFFIXES:
-            suffix = suffix.strip()
-            if suffix:
-                fqdn = f"{device_name}.{suffix}"
-                desired_records[fqdn] = ip
+_build_records = _compile_record_builder()
 
-    # Add services
-    for service in tailscale_services:
-        service_name = service.get('name', '').lower()
-        addrs = service.get('addrs', [])
-        ip = addrs[0] if addrs else ''
 
-        if not service_name or not ip:
-            continue
+def _name_ip_pairs(items: List[Dict], get_name: Callable[[Dict], str], get_ip: Callable[[Dict], str]) -> Iterator[Tuple[str, str]]:
+    """Yield (name, ip) for every item that has both."""
+    for item in items:
+        name = get_name(item)
+        ip = get_ip(item)
+        if name and ip:
+            yield name, ip
 
-        if CREATE_BARE_HOSTNAME:
-            desired_records[service_name] = ip
 
-        for suffix in DNS_SUFFIXES:
-            suffix = suffix.strip()
-            if suffix:
-                fqdn = f"{service_name}.{suffix}"
-                desired_records[fqdn] = ip
+def get_tailscale_records(tailscale_nodes: List[Dict], tailscale_services: List[Dict]) -> Dict[str, str]:
+    """Build the desired DNS records map from Tailscale nodes & services.
 
+    Returns a dict mapping hostname -> ip.
+    """
+    desired_records: Dict[str, str] = {}
+    for name, ip in itertools.chain(
+        # Nodes: short device name, first IP (usually IPv4)
+        _name_ip_pairs(
+            tailscale_nodes,
+            lambda node: node.get('name', '').split('.', 1)[0].lower(),
+            lambda node: (node.get('addresses') or [''])[0]
+        ),
+        # Services: canonical service name, first address
+        _name_ip_pairs(
+            tailscale_services,
+            lambda service: service.get('name', '').lower(),
+            lambda service: (service.get('addrs') or [''])[0]
+        ),
+    ):
+        _build_records(name, ip, desired_records)
     return desired_records
 
 
-def get_controld_records(folder_id: str) -> List[Dict]:
-    """Fetch existing ControlD DNS records for a specific folder."""
-    url = f"{CONTROLD_API_BASE}/profiles/{CONTROLD_PROFILE_ID}/rules/{folder_id}"
-    headers = {'Authorization': f'Bearer {CONTROLD_API_TOKEN}'}
+def get_controld_records(folder_id: str, state: Dict) -> List[Dict]:
+    """Fetch existing ControlD DNS records for a specific folder.
+
+    If the server confirms the cached rules are current, the full rules kept
+    in state are returned instead. Updates the ETag and rules cached in state.
+    """
+    url = f"/profiles/{CONTROLD_PROFILE_ID}/rules/{folder_id}"
+    headers = {}
+    if (state.get('controld_etag') and state.get('controld_folder_id') == folder_id
+            and isinstance(state.get('controld_rules'), list)):
+        headers['If-None-Match'] = state['controld_etag']
     
     try:
-        response = requests.get(url, headers=headers)
+        response = CD_CLIENT.get(url, headers=headers)
+        if response.status_code == 304:
+            rules = state['controld_rules']
+            _log(f"✓ Found {len(rules)} existing rules in ControlD '{CONTROLD_FOLDER_NAME}' folder (unchanged)")
+            return rules
         response.raise_for_status()
-        rules = response.json().get('body', {}).get('rules', [])
+        rules = _json(response).get('body', {}).get('rules', [])
+        _remember_response(
+            state, 'controld_etag', response.headers.get('ETag'),
+            controld_folder_id=folder_id, controld_rules=rules,
+        )
         
-        print(f"✓ Found {len(rules)} existing rules in ControlD '{CONTROLD_FOLDER_NAME}' folder")
+        _log(f"✓ Found {len(rules)} existing rules in ControlD '{CONTROLD_FOLDER_NAME}' folder")
         return rules
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching ControlD rules: {e}")
+    except (httpx.HTTPError, ValueError) as e:
+        _log(f"Error fetching ControlD rules: {e}")
         sys.exit(1)
 
 
-def get_or_create_controld_rules_folder() -> str:
-    """Get the folder ID for the Tailscale folder, creating it if necessary."""
-    url = f"{CONTROLD_API_BASE}/profiles/{CONTROLD_PROFILE_ID}/groups"
-    headers = {'Authorization': f'Bearer {CONTROLD_API_TOKEN}'}
-    
+def _fetch_controld_rules(folder_id: str) -> List[Dict]:
+    """Fetch the current rules in a ControlD folder, raising on failure."""
+    response = CD_CLIENT.get(f"/profiles/{CONTROLD_PROFILE_ID}/rules/{folder_id}")
+    response.raise_for_status()
+    return _json(response).get('body', {}).get('rules', [])
+
+
+def get_controld_rules_folder() -> Optional[str]:
+    """Get the folder ID for the Tailscale folder, or None if it doesn't exist."""
+    url = f"/profiles/{CONTROLD_PROFILE_ID}/groups"
     try:
-        # Get existing folders
-        response = requests.get(url, headers=headers)
+        response = CD_CLIENT.get(url)
         response.raise_for_status()
-        groups = response.json().get('body', {}).get('groups', [])
+        groups = _json(response).get('body', {}).get('groups', [])
 
         # Check if folder exists. ControlD response uses 'group' for the name.
         for group in groups:
             group_name = group.get('group') or group.get('name') or ''
             if group_name and group_name.lower() == CONTROLD_FOLDER_NAME.lower():
                 pk = group.get('PK')
-                print(f"✓ Found existing folder: {CONTROLD_FOLDER_NAME}")
+                _log(f"✓ Found existing folder: {CONTROLD_FOLDER_NAME}")
                 return pk
+        return None
+    except (httpx.HTTPError, ValueError) as e:
+        _log(f"Error getting folder: {e}")
+        sys.exit(1)
 
-        # Create folder if it doesn't exist
+
+def create_controld_rules_folder() -> str:
+    """Create the Tailscale folder and return its ID."""
+    url = f"/profiles/{CONTROLD_PROFILE_ID}/groups"
+    try:
         print(f"Creating folder: {CONTROLD_FOLDER_NAME}")
         # ControlD expects 'group' when creating a folder
-        response = requests.post(
-            url,
-            headers={**headers, 'Content-Type': 'application/json'},
-            json={'group': CONTROLD_FOLDER_NAME}
-        )
+        response = CD_CLIENT.post(url, json={'group': CONTROLD_FOLDER_NAME})
         response.raise_for_status()
-        folder_id = response.json().get('body', {}).get('folder', {}).get('PK')
+        folder_id = _json(response).get('body', {}).get('folder', {}).get('PK')
         print(f"✓ Created folder: {CONTROLD_FOLDER_NAME}")
         return folder_id
-    except requests.exceptions.RequestException as e:
-        print(f"Error getting/creating folder: {e}")
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"Error creating folder: {e}")
         sys.exit(1)
 
 
-def create_controld_record(hostname: str, ip: str, folder_id: str, dry_run: bool = False) -> bool:
+async def create_controld_record(client: httpx.AsyncClient, hostname: str, ip: str, folder_id: str, dry_run: bool = False) -> bool:
     """Create a DNS rule in ControlD."""
     if dry_run:
         return True
     
-    url = f"{CONTROLD_API_BASE}/profiles/{CONTROLD_PROFILE_ID}/rules"
-    headers = {
-        'Authorization': f'Bearer {CONTROLD_API_TOKEN}',
-        'Content-Type': 'application/json'
-    }
+    url = f"/profiles/{CONTROLD_PROFILE_ID}/rules"
     data = {
         'group': folder_id,
         'status': 1,  # 1 = enabled
@@ -231,24 +519,69 @@ def create_controld_record(hostname: str, ip: str, folder_id: str, dry_run: bool
     }
     
     try:
-        response = requests.post(url, headers=headers, json=data)
+        response = await client.post(url, json=data)
         response.raise_for_status()
         return True
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"  Error creating rule {hostname}: {e}")
         return False
 
 
-def update_controld_record(rule_id: str, hostname: str, ip: str, folder_id: str, dry_run: bool = False) -> bool:
-    """Update an existing DNS rule in ControlD."""
+async def create_controld_records(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, hostnames: List[str], ip: str, folder_id: str, dry_run: bool = False) -> List[str]:
+    """Create DNS rules for several hostnames sharing an IP in one ControlD request.
+
+    If ControlD rejects the batch itself (a 4xx other than auth or rate
+    limiting), falls back to one request per hostname so one bad hostname
+    doesn't block the rest. All requests run under the concurrency semaphore.
+    Returns the hostnames that were created.
+    """
     if dry_run:
-        return True
+        return hostnames
     
-    url = f"{CONTROLD_API_BASE}/profiles/{CONTROLD_PROFILE_ID}/rules/{rule_id}"
-    headers = {
-        'Authorization': f'Bearer {CONTROLD_API_TOKEN}',
-        'Content-Type': 'application/json'
+    url = f"/profiles/{CONTROLD_PROFILE_ID}/rules"
+    data = {
+        'group': folder_id,
+        'status': 1,  # 1 = enabled
+        'do': 2,  # 2 = SPOOF
+        'via': ip,  # IP to spoof to
+        'hostnames': hostnames
     }
+    
+    try:
+        async with semaphore:
+            response = await client.post(url, json=data)
+        response.raise_for_status()
+        return hostnames
+    except httpx.HTTPStatusError as e:
+        status = e.response.status_code
+        if len(hostnames) == 1 or not 400 <= status < 500 or status in BATCH_NO_SPLIT_STATUSES:
+            print(f"  Error creating rules {', '.join(hostnames)}: {e}")
+            return []
+    except httpx.HTTPError as e:
+        print(f"  Error creating rules {', '.join(hostnames)}: {e}")
+        return []
+    
+    results = await asyncio.gather(*(
+        _bounded(semaphore, create_controld_record(client, hostname, ip, folder_id)) for hostname in hostnames
+    ))
+    return [hostname for hostname, ok in zip(hostnames, results) if ok]
+
+
+class RuleConflictError(Exception):
+    """Raised when a rule changed on the server since it was fetched."""
+
+
+async def update_controld_record(client: httpx.AsyncClient, rule_id: str, hostname: str, ip: str, folder_id: str, dry_run: bool = False, etag: Optional[str] = None) -> bool:
+    """Update an existing DNS rule in ControlD.
+
+    If an ETag is given the update is conditional on it, and
+    RuleConflictError is raised when the server rejects it as stale.
+    """
+    if dry_run:
+        return True
+    
+    url = f"/profiles/{CONTROLD_PROFILE_ID}/rules/{rule_id}"
+    headers = {'If-Match': etag} if etag else {}
     data = {
         'group': folder_id,
         'status': 1,  # 1 = enabled
@@ -258,35 +591,55 @@ def update_controld_record(rule_id: str, hostname: str, ip: str, folder_id: str,
     }
     
     try:
-        response = requests.put(url, headers=headers, json=data)
+        response = await client.put(url, json=data, headers=headers)
+        if response.status_code == 412:
+            raise RuleConflictError(hostname)
         response.raise_for_status()
         return True
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"  Error updating rule {hostname}: {e}")
         return False
 
 
-def delete_controld_record(rule_id: str, hostname: str, dry_run: bool = False) -> bool:
+async def delete_controld_record(client: httpx.AsyncClient, rule_id: str, hostname: str, dry_run: bool = False) -> bool:
     """Delete a DNS rule from ControlD."""
     if dry_run:
         return True
     
-    url = f"{CONTROLD_API_BASE}/profiles/{CONTROLD_PROFILE_ID}/rules/{rule_id}"
-    headers = {'Authorization': f'Bearer {CONTROLD_API_TOKEN}'}
+    url = f"/profiles/{CONTROLD_PROFILE_ID}/rules/{rule_id}"
     
     try:
-        response = requests.delete(url, headers=headers)
+        response = await client.delete(url)
         response.raise_for_status()
         return True
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"  Error deleting rule {hostname}: {e}")
         return False
 
 
+async def _bounded(semaphore: asyncio.Semaphore, coro):
+    """Await a coroutine while holding the concurrency semaphore."""
+    async with semaphore:
+        return await coro
+
+
+def load_sync_state() -> Dict:
+    """Load the state saved by the last successful live sync, if any."""
+    return _read_json_file(SYNC_STATE_FILE) or {}
+
+
+def save_sync_state(state: Dict):
+    """Atomically write the sync state for the next run."""
+    try:
+        _write_json_file(SYNC_STATE_FILE, state)
+    except OSError as e:
+        print(f"Warning: Could not save sync state: {e}")
+
+
 def create_backup(existing_rules: List[Dict], folder_id: str):
-    """Create a timestamped backup of existing rules."""
+    """Create a timestamped, gzipped backup of existing rules."""
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"controld_backup_{timestamp}.json"
+    filename = f"controld_backup_{timestamp}.json.gz"
     
     backup_data = {
         'timestamp': timestamp,
@@ -297,16 +650,47 @@ def create_backup(existing_rules: List[Dict], folder_id: str):
     }
     
     try:
-        with open(filename, 'w') as f:
-            json.dump(backup_data, f, indent=2)
+        with gzip.open(filename, 'wb', compresslevel=6) as f:
+            f.write(orjson.dumps(backup_data))
         print(f"✓ Backup created: {filename}\n")
+        prune_backups()
         return filename
     except Exception as e:
         print(f"Warning: Could not create backup: {e}\n")
         return None
 
 
-def sync_dns_records(dry_run: bool = True, quiet: bool = False):
+def prune_backups():
+    """Delete all but the newest BACKUP_RETENTION backup files."""
+    if BACKUP_RETENTION <= 0:
+        return
+    
+    # Timestamps in the names sort chronologically
+    backups = sorted(Path.cwd().glob('controld_backup_*.json.gz'))
+    for path in backups[:-BACKUP_RETENTION]:
+        try:
+            path.unlink()
+        except OSError as e:
+            print(f"Warning: Could not delete old backup {path.name}: {e}")
+
+
+def print_summary(dry_run: bool, created: int, updated: int, deleted: int):
+    """Print the created/updated/deleted counts for a run."""
+    print(f"\n{'='*50}")
+    if dry_run:
+        print(f"DRY RUN Summary (no changes made):")
+    else:
+        print(f"Sync complete!")
+    print(f"  Created: {created}")
+    print(f"  Updated: {updated}")
+    print(f"  Deleted: {deleted}")
+    print(f"{'='*50}")
+    
+    if dry_run and (created > 0 or updated > 0 or deleted > 0):
+        print("\nTo apply these changes, run with --apply flag")
+
+
+async def sync_dns_records(dry_run: bool = True, quiet: bool = False, force: bool = False, debug: bool = False):
     """Main sync function."""
     mode = "DRY RUN" if dry_run else "LIVE"
     if not quiet:
@@ -319,43 +703,72 @@ def sync_dns_records(dry_run: bool = True, quiet: bool = False):
     
     # Validate configuration
     validate_config()
-
-    
-    # Get or create folder
-    folder_id = get_or_create_controld_rules_folder()
     
-    # Build desired DNS records from Tailscale nodes and services
-    desired_records = get_tailscale_records()
+    # Spread scheduled runs out so they don't all hit the APIs on the same second
+    if quiet and not dry_run and JITTER_SECONDS > 0:
+        await asyncio.sleep(random.uniform(0, JITTER_SECONDS))
+
+    state = {} if force else load_sync_state()
     
-    # Get existing ControlD rules in our folder
-    existing_rules = get_controld_records(folder_id)
-    for rule in existing_rules:
-        print(f"  Existing rule: {rule.get('PK')} -> {rule.get('action', {}).get('via', '')}")
+    # Look up the folder while fetching Tailscale nodes and services, then
+    # fetch the folder's rules once its ID is known
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        folder_future = loop.run_in_executor(executor, get_controld_rules_folder)
+        nodes_future = loop.run_in_executor(
+            executor, functools.partial(get_tailscale_nodes, refresh=force)
+        )
+        services_future = loop.run_in_executor(
+            executor, functools.partial(get_tailscale_services, refresh=force)
+        )
+        try:
+            tailscale_nodes, tailscale_services = await asyncio.gather(nodes_future, services_future)
+        except httpx.HTTPError as e:
+            # The other lookups may still be running and printing
+            _log(f"Error fetching Tailscale nodes and services: {e}")
+            await asyncio.gather(folder_future, nodes_future, services_future, return_exceptions=True)
+            sys.exit(1)
         
+        # Build desired DNS records from Tailscale nodes and services
+        desired_records = get_tailscale_records(tailscale_nodes, tailscale_services)
         
-    # Create backup before making changes (only in live mode)
-    if not dry_run and existing_rules:
-        create_backup(existing_rules, folder_id)
-      
+        # Get existing ControlD rules in our folder; a missing folder has none
+        folder_id = await folder_future
+        if folder_id is None:
+            print(f"✓ Folder '{CONTROLD_FOLDER_NAME}' does not exist yet")
+            existing_rules = []
+        else:
+            existing_rules = await loop.run_in_executor(executor, get_controld_records, folder_id, state)
+    if debug:
+        for rule in existing_rules:
+            print(f"  Existing rule: {rule.get('PK')} -> {rule.get('action', {}).get('via', '')}")
+    
     print(f"\n✓ Generated {len(desired_records)} desired DNS records")
     # for hostname, ip in desired_records.items():
     #     print(f"  • {hostname} → {ip}")
     
-    # Build map of existing rules in our folder
-    existing_map = {}
-    for rule in existing_rules:
-        # Extract hostname from hostnames array
-        hostname = rule.get('PK')
-        if not hostname:
-            continue
-        
-        # Extract IP from via field
-        ip = rule.get('action', {}).get('via', '')
-        
-        existing_map[hostname] = {
-            'id': hostname,
-            'ip': ip
-        }
+    # Map hostname -> IP for existing rules in our folder; a rule's ID is its hostname
+    existing_map = {
+        rule['PK']: rule.get('action', {}).get('via', '')
+        for rule in existing_rules if rule.get('PK')
+    }
+    rule_etags = {rule['PK']: rule['_etag'] for rule in existing_rules if rule.get('PK') and rule.get('_etag')}
+    
+    # Nothing to do if ControlD already matches Tailscale
+    if existing_map == desired_records:
+        if not dry_run:
+            save_sync_state(state)
+        print("\n✓ ControlD already matches Tailscale, nothing to do")
+        print_summary(dry_run, 0, 0, 0)
+        return
+    
+    # Only create the folder once we know there is something to put in it
+    if folder_id is None and not dry_run:
+        folder_id = create_controld_rules_folder()
+    
+    # Create backup before making changes (only in live mode)
+    if not dry_run and existing_rules:
+        create_backup(existing_rules, folder_id)
     
     # Sync records
     created = 0
@@ -364,40 +777,119 @@ def sync_dns_records(dry_run: bool = True, quiet: bool = False):
     
     print("\nSyncing records...")
     
-    # Create or update records
-    for hostname, ip in desired_records.items():
-        if hostname in existing_map:
-            existing_rule = existing_map[hostname]
-            if existing_rule['ip'] != ip:
-                if update_controld_record(existing_rule['id'], hostname, ip, folder_id, dry_run):
-                    print(f"  ↻ Updated: {hostname} → {ip}")
-                    updated += 1
-            else:
-                print(f"  ✓ Unchanged: {hostname}")
-        else:
-            if create_controld_record(hostname, ip, folder_id, dry_run):
-                print(f"  + Created: {hostname} → {ip}")
-                created += 1
+    # Diff desired against existing records; the three sets are disjoint
+    desired_keys = desired_records.keys()
+    existing_keys = existing_map.keys()
+    to_create = [(hostname, desired_records[hostname]) for hostname in sorted(desired_keys - existing_keys)]
+    to_delete = sorted(existing_keys - desired_keys)
+    common = desired_keys & existing_keys
+    to_update = [
+        (hostname, desired_records[hostname])
+        for hostname in sorted(common)
+        if existing_map[hostname] != desired_records[hostname]
+    ]
+    if debug:
+        for hostname in sorted(common.difference(hostname for hostname, _ in to_update)):
+            print(f"  ✓ Unchanged: {hostname}")
+    unchanged = len(common) - len(to_update)
+    if unchanged:
+        print(f"  ✓ {unchanged} unchanged")
     
-    # Delete rules that are no longer in Tailscale
-    for hostname, rule_info in existing_map.items():
-        if hostname not in desired_records:
-            if delete_controld_record(rule_info['id'], hostname, dry_run):
-                print(f"  - Deleted: {hostname}")
-                deleted += 1
+    # Group new hostnames by IP so each batch is a single request
+    create_batches = []
+    hostnames_by_ip: Dict[str, List[str]] = {}
+    for hostname, ip in to_create:
+        hostnames_by_ip.setdefault(ip, []).append(hostname)
+    for ip, hostnames in hostnames_by_ip.items():
+        for start in range(0, len(hostnames), CONTROLD_BATCH_SIZE):
+            create_batches.append((hostnames[start:start + CONTROLD_BATCH_SIZE], ip))
     
-    print(f"\n{'='*50}")
-    if dry_run:
-        print(f"DRY RUN Summary (no changes made):")
-    else:
-        print(f"Sync complete!")
-    print(f"  Created: {created}")
-    print(f"  Updated: {updated}")
-    print(f"  Deleted: {deleted}")
-    print(f"{'='*50}")
+    # The three hostname sets are disjoint, so deletes run alongside
+    # creates and updates instead of waiting for them to finish
+    semaphore = asyncio.Semaphore(CONTROLD_MAX_CONCURRENCY)
+    async with create_async_client(CONTROLD_API_BASE, CONTROLD_API_TOKEN) as client:
+        create_results, update_results, delete_results = await asyncio.gather(
+            asyncio.gather(*(
+                create_controld_records(client, semaphore, hostnames, ip, folder_id, dry_run)
+                for hostnames, ip in create_batches
+            ), return_exceptions=True),
+            asyncio.gather(*(
+                _bounded(semaphore, update_controld_record(client, hostname, hostname, ip, folder_id, dry_run, rule_etags.get(hostname)))
+                for hostname, ip in to_update
+            ), return_exceptions=True),
+            asyncio.gather(*(
+                _bounded(semaphore, delete_controld_record(client, hostname, hostname, dry_run))
+                for hostname in to_delete
+            ), return_exceptions=True),
+        )
+        
+        # Rules rejected as stale changed since they were fetched: refetch them
+        # and retry once against the current server state
+        already_current = set()
+        conflicts = [
+            (hostname, ip)
+            for (hostname, ip), result in zip(to_update, update_results)
+            if isinstance(result, RuleConflictError)
+        ]
+        if conflicts:
+            print(f"  ! {len(conflicts)} rules changed on the server, refetching")
+            try:
+                current_rules = await loop.run_in_executor(None, _fetch_controld_rules, folder_id)
+            except (httpx.HTTPError, ValueError) as e:
+                print(f"  Error refetching ControlD rules: {e}")
+                current_rules = []
+            current_map = {rule['PK']: rule for rule in current_rules if rule.get('PK')}
+            retried = {}
+            retries = []
+            for hostname, ip in conflicts:
+                if hostname not in current_map:
+                    continue
+                if current_map[hostname].get('action', {}).get('via', '') == ip:
+                    already_current.add(hostname)
+                else:
+                    retries.append((hostname, ip))
+            retry_results = await asyncio.gather(*(
+                _bounded(semaphore, update_controld_record(client, hostname, hostname, ip, folder_id, dry_run, current_map[hostname].get('_etag')))
+                for hostname, ip in retries
+            ), return_exceptions=True)
+            retried.update(zip(retries, retry_results))
+            update_results = [
+                retried.get(update, result) if isinstance(result, RuleConflictError) else result
+                for update, result in zip(to_update, update_results)
+            ]
     
-    if dry_run and (created > 0 or updated > 0 or deleted > 0):
-        print("\nTo apply these changes, run with --apply flag")
+    for (hostnames, ip), result in zip(create_batches, create_results):
+        if isinstance(result, list):
+            for hostname in result:
+                print(f"  + Created: {hostname} → {ip}")
+            created += len(result)
+        elif isinstance(result, BaseException):
+            print(f"  Error creating rules {', '.join(hostnames)}: {result!r}")
+    for (hostname, ip), result in zip(to_update, update_results):
+        if hostname in already_current:
+            print(f"  ✓ Unchanged: {hostname} (already current on the server)")
+        elif result is True:
+            print(f"  ↻ Updated: {hostname} → {ip}")
+            updated += 1
+        elif isinstance(result, RuleConflictError):
+            print(f"  Error updating rule {hostname}: changed on the server, skipped")
+        elif isinstance(result, BaseException):
+            print(f"  Error updating rule {hostname}: {result!r}")
+    for hostname, result in zip(to_delete, delete_results):
+        if result is True:
+            print(f"  - Deleted: {hostname}")
+            deleted += 1
+        elif isinstance(result, BaseException):
+            print(f"  Error deleting rule {hostname}: {result!r}")
+    
+    # Remember this run only if ControlD now matches Tailscale exactly
+    done = created + updated + deleted + len(already_current)
+    if not dry_run and done == len(to_create) + len(to_update) + len(to_delete):
+        # The cached ControlD rules predate the changes made in this run
+        _remember_response(state, 'controld_etag', None, controld_folder_id=None, controld_rules=None)
+        save_sync_state(state)
+    
+    print_summary(dry_run, created, updated, deleted)
 
 
 def main():
@@ -409,6 +901,7 @@ Examples:
     uv run sync                                 # Dry run (preview changes)
     uv run sync --apply                         # Apply changes to ControlD
     uv run sync --apply --quiet                 # Apply changes to ControlD (quiet)
+    uv run sync --apply --force                 # Apply without using cached API responses
         '''
     )
     parser.add_argument(
@@ -419,16 +912,21 @@ Examples:
     parser.add_argument(
         '--debug',
         action='store_true',
-        help='Enable debug output for HTTP requests'
+        help='Enable debug output (list existing and unchanged rules)'
     )
     parser.add_argument(
         '--quiet',
         action='store_true',
         help='Suppress startup informational output'
     )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Ignore cached API responses and refetch everything'
+    )
     
     args = parser.parse_args()
-    sync_dns_records(dry_run=not args.apply, quiet=args.quiet)
+    asyncio.run(sync_dns_records(dry_run=not args.apply, quiet=args.quiet, force=args.force, debug=args.debug))
 
 
 if __name__ == '__main__':